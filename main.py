@@ -1,187 +1,965 @@
 #!/usr/bin/env python3
 import os
 import sys
+import errno
+import logging
+import time
+import queue
+import shlex
+import ctypes
+import pickle
+import marshal
+import stat
+import struct
+import functools
+import hashlib
+import signal
+import threading
 import subprocess
 import tempfile
 import shutil
-from pathlib import Path
+from typing import Optional
 from dataclasses import dataclass
 
 
-@dataclass
+log = logging.getLogger("pycontainer")
+
+_SEP = "=" * 60
+
+MASTER_ROOTFS = "/var/lib/pycontainer/master"
+CONTAINERS_DIR = "/var/lib/pycontainer/containers"
+CACHE_DIR = "/var/cache/pycontainer"
+
+# Версия содержимого мастера: при изменении ROOTFS_DIRS/DEV_NODES и т.п. — увеличить
+MASTER_LAYOUT = 2
+MASTER_STAMP = "etc/pycontainer-layout"
+
+ROOTFS_DIRS = ('bin', 'lib', 'lib64', 'proc', 'tmp', 'dev', 'etc')
+OVERLAY_DIRS = ('upper', 'work', 'merged')
+
+# (имя, major, minor) символьных устройств, создаваемых в мастере один раз
+DEV_NODES = (
+    ('null', 1, 3),
+    ('zero', 1, 5),
+    ('full', 1, 7),
+    ('random', 1, 8),
+    ('urandom', 1, 9),
+    ('tty', 5, 0),
+)
+
+_BUSYBOX_SRC = next(
+    (p for p in ('/usr/bin/busybox', '/bin/busybox', '/usr/bin/busybox-static') if os.path.exists(p)),
+    None
+)
+_BASH_SRC = '/usr/bin/bash' if os.path.exists('/usr/bin/bash') else None
+_HAS_PYTHON3 = shutil.which('python3') is not None
+
+CORE_SRC = os.path.join(os.path.dirname(os.path.abspath(__file__)), "pycontainer_core.c")
+
+_BASH_DEPS_CACHE: dict[tuple, list[str]] = {}
+_BASH_DEPS_CACHE_FILE = f"{CACHE_DIR}/bash_deps.pkl"
+_BUSYBOX_APPLETS_CACHE: dict[tuple, list[str]] = {}
+_BUSYBOX_APPLETS_CACHE_FILE = f"{CACHE_DIR}/busybox_applets.pkl"
+
+# Порядок важен: mnt последним, после него /proc-пути уже другие
+NAMESPACES = ('pid', 'net', 'uts', 'ipc', 'mnt')
+
+CLONE_NEWNS = 0x00020000
+CLONE_NEWUTS = 0x04000000
+CLONE_NEWIPC = 0x08000000
+CLONE_NEWPID = 0x20000000
+CLONE_NEWNET = 0x40000000
+
+MS_NOSUID = 0x2
+MS_NODEV = 0x4
+MS_NOEXEC = 0x8
+MS_BIND = 0x1000
+MS_REC = 0x4000
+MS_PRIVATE = 1 << 18
+MS_SHARED = 1 << 20
+MNT_DETACH = 2
+
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_INTERP = 3
+
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_RPATH = 15
+DT_RUNPATH = 29
+
+_LD_CACHE_MAGIC = b"glibc-ld.so.cache1.1"
+
+_libc = ctypes.CDLL("libc.so.6", use_errno=True)
+_libc.unshare.argtypes = (ctypes.c_int,)
+_libc.setns.argtypes = (ctypes.c_int, ctypes.c_int)
+_libc.mount.argtypes = (ctypes.c_char_p, ctypes.c_char_p, ctypes.c_char_p,
+                        ctypes.c_ulong, ctypes.c_char_p)
+_libc.umount2.argtypes = (ctypes.c_char_p, ctypes.c_int)
+
+
+def _cached(cache: dict, cache_file: str, key: tuple, compute):
+    """Значение по ключу из кэша в памяти, затем с диска, иначе compute()"""
+    if key in cache:
+        return cache[key]
+    
+    try:
+        with open(cache_file, 'rb') as f:
+            cache.update(pickle.load(f))
+    except (OSError, EOFError, pickle.UnpicklingError):
+        pass
+    
+    if key not in cache:
+        cache[key] = compute()
+        try:
+            os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+            with open(cache_file, 'wb') as f:
+                pickle.dump(cache, f)
+        except OSError:
+            pass
+    
+    return cache[key]
+
+
+def _mkdirs_at(parent: str, names: tuple):
+    """mkdirat относительно открытого каталога, без разбора пути на каждый вызов"""
+    parent_fd = os.open(parent, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        for name in names:
+            os.mkdir(name, mode=0o755, dir_fd=parent_fd)
+    finally:
+        os.close(parent_fd)
+
+
+def _link_or_copy(src: str, dst: str):
+    """Жёсткая ссылка, если src и dst на одной ФС, иначе копия"""
+    # os.link() на Linux не разыменовывает символические ссылки
+    src = os.path.realpath(src)
+    if os.stat(src).st_dev == os.stat(os.path.dirname(dst)).st_dev:
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    _fastcopy(src, dst)
+
+
+def _copy_node(src: str, dst: str):
+    """copy2, но устройства пересоздаются через mknod, а не читаются"""
+    st = os.lstat(src)
+    if stat.S_ISCHR(st.st_mode) or stat.S_ISBLK(st.st_mode):
+        os.mknod(dst, st.st_mode, st.st_rdev)
+        shutil.copystat(src, dst)
+    else:
+        shutil.copy2(src, dst)
+
+
+def _fastcopy(src: str, dst: str):
+    """Копирование в ядре: copy_file_range (reflink на BTRFS/XFS), иначе sendfile"""
+    sfd = os.open(src, os.O_RDONLY)
+    try:
+        size = os.fstat(sfd).st_size
+        dfd = os.open(dst, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            offset = 0
+            use_sendfile = False
+            while offset < size:
+                if not use_sendfile:
+                    try:
+                        n = os.copy_file_range(sfd, dfd, size - offset, offset, offset)
+                    except OSError as e:
+                        if e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+                            raise
+                        use_sendfile = True
+                        continue
+                else:
+                    os.lseek(dfd, offset, os.SEEK_SET)
+                    n = os.sendfile(dfd, sfd, offset, size - offset)
+                if n == 0:
+                    # copy_file_range отдаёт 0 и там, где не умеет (procfs, часть FUSE)
+                    if use_sendfile:
+                        break
+                    use_sendfile = True
+                    continue
+                offset += n
+        finally:
+            os.close(dfd)
+        if offset < size:
+            raise OSError(errno.EIO, f"{src}: скопировано {offset} из {size} байт")
+    finally:
+        os.close(sfd)
+    
+    shutil.copystat(src, dst)
+
+
+def _check(ret: int):
+    if ret != 0:
+        err = ctypes.get_errno()
+        raise OSError(err, os.strerror(err))
+
+
+def _setns(fd: int):
+    _check(_libc.setns(fd, 0))
+
+
+def _unshare(flags: int):
+    _check(_libc.unshare(flags))
+
+
+def _mount(source: Optional[str], target: str, fstype: Optional[str],
+           flags: int = 0, data: Optional[str] = None):
+    enc = lambda v: v.encode() if v is not None else None
+    _check(_libc.mount(enc(source), enc(target), enc(fstype), flags, enc(data)))
+
+
+def _umount2(target: str, flags: int = 0):
+    _check(_libc.umount2(target.encode(), flags))
+
+
+def _make_shared(path: str):
+    """Сделать path shared-точкой монтирования: монтирования под ним видны в slave-namespaces"""
+    os.makedirs(path, exist_ok=True)
+    with open('/proc/self/mountinfo') as f:
+        mounted = any(line.split()[4] == path for line in f)
+    if not mounted:
+        _mount(path, path, None, MS_BIND | MS_REC)
+    _mount(None, path, None, MS_SHARED)
+
+
+def _spawn(argv: list[str], setsid: bool = False) -> int:
+    """posix_spawnp вспомогательной утилиты с stdio в /dev/null"""
+    devnull = [(os.POSIX_SPAWN_OPEN, fd, os.devnull, os.O_RDWR, 0) for fd in (0, 1, 2)]
+    return os.posix_spawnp(argv[0], argv, os.environ, file_actions=devnull, setsid=setsid)
+
+
+@functools.lru_cache(maxsize=None)
+def _core_lib() -> str:
+    """Путь к сборке C-ядра; хэш исходника в имени — библиотека со старым ABI не загрузится"""
+    with open(CORE_SRC, 'rb') as f:
+        digest = hashlib.sha256(f.read()).hexdigest()[:16]
+    return f"{CACHE_DIR}/pycontainer_core-{digest}.so"
+
+
+@functools.lru_cache(maxsize=None)
+def _load_core() -> Optional[ctypes.CDLL]:
+    """Собрать при необходимости и загрузить pycontainer_core.c; None — нет компилятора или ошибка сборки"""
+    try:
+        lib = _core_lib()
+        if not os.path.exists(lib):
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = f"{lib}.{os.getpid()}"
+            # Сборка разовая: stderr компилятора нужен в логе, если поставляемый исходник не собрался
+            result = subprocess.run(
+                [os.environ.get('CC', 'cc'), '-O2', '-shared', '-fPIC', '-o', tmp, CORE_SRC],
+                stdin=subprocess.DEVNULL,
+                capture_output=True,
+                text=True,
+                check=False
+            )
+            if result.returncode != 0:
+                try:
+                    os.unlink(tmp)
+                except FileNotFoundError:
+                    pass
+                log.warning("⚠ C-ядро не собралось, используется Python-путь:\n%s", result.stderr.strip())
+                return None
+            os.rename(tmp, lib)
+        core = ctypes.CDLL(lib)
+    except OSError as e:
+        log.debug("C-ядро недоступно (%s), используется Python-путь", e)
+        return None
+    
+    core.pyc_run.argtypes = (ctypes.c_int, ctypes.c_char_p, ctypes.POINTER(ctypes.c_char_p))
+    core.pyc_run.restype = ctypes.c_int
+    return core
+
+
+def _exit_code(status: int) -> int:
+    """Код возврата в стиле shell: 128 + сигнал для убитых процессов"""
+    code = os.waitstatus_to_exitcode(status)
+    return code if code >= 0 else 128 - code
+
+
+def _elf_info(path: str) -> tuple:
+    """(класс, машина, интерпретатор, DT_NEEDED, RPATH/RUNPATH) из заголовков ELF"""
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:4] != b'\x7fELF':
+        raise ValueError(f"{path}: не ELF")
+    
+    end = '<' if data[5] == 1 else '>'
+    elf_class = data[4]
+    machine, = struct.unpack_from(end + 'H', data, 18)
+    
+    if elf_class == 2:
+        phoff, = struct.unpack_from(end + 'Q', data, 32)
+        phentsize, phnum = struct.unpack_from(end + 'HH', data, 54)
+        # p_type, p_flags, p_offset, p_vaddr, p_paddr, p_filesz
+        ph_fmt, ph_idx = end + 'IIQQQQ', (0, 2, 3, 5)
+        dyn_fmt = end + 'qQ'
+    else:
+        phoff, = struct.unpack_from(end + 'I', data, 28)
+        phentsize, phnum = struct.unpack_from(end + 'HH', data, 42)
+        # p_type, p_offset, p_vaddr, p_paddr, p_filesz
+        ph_fmt, ph_idx = end + 'IIIII', (0, 1, 2, 4)
+        dyn_fmt = end + 'iI'
+    
+    loads, interp, dynamic = [], None, None
+    for i in range(phnum):
+        ph = struct.unpack_from(ph_fmt, data, phoff + i * phentsize)
+        p_type, p_offset, p_vaddr, p_filesz = (ph[j] for j in ph_idx)
+        if p_type == PT_LOAD:
+            loads.append((p_vaddr, p_offset, p_filesz))
+        elif p_type == PT_INTERP:
+            interp = data[p_offset:p_offset + p_filesz].rstrip(b'\0').decode()
+        elif p_type == PT_DYNAMIC:
+            dynamic = (p_offset, p_filesz)
+    
+    if dynamic is None:
+        return elf_class, machine, interp, [], []
+    
+    strtab, needed, rpaths = None, [], []
+    dyn_size = struct.calcsize(dyn_fmt)
+    for off in range(dynamic[0], dynamic[0] + dynamic[1], dyn_size):
+        tag, val = struct.unpack_from(dyn_fmt, data, off)
+        if tag == DT_NULL:
+            break
+        if tag == DT_STRTAB:
+            strtab = val
+        elif tag == DT_NEEDED:
+            needed.append(val)
+        elif tag in (DT_RPATH, DT_RUNPATH):
+            rpaths.append(val)
+    
+    # DT_STRTAB — виртуальный адрес, переводим в смещение в файле
+    base = None if strtab is None else next(
+        (off + strtab - vaddr for vaddr, off, size in loads if vaddr <= strtab < vaddr + size),
+        None
+    )
+    if base is None:
+        if needed or rpaths:
+            raise ValueError(f"{path}: DT_STRTAB вне сегментов PT_LOAD")
+        return elf_class, machine, interp, [], []
+    string = lambda i: data[base + i:data.index(b'\0', base + i)].decode()
+    
+    origin = os.path.dirname(os.path.realpath(path))
+    dirs = [d.replace('$ORIGIN', origin).replace('${ORIGIN}', origin)
+            for i in rpaths for d in string(i).split(':') if d]
+    return elf_class, machine, interp, [string(i) for i in needed], dirs
+
+
+@functools.lru_cache(maxsize=None)
+def _ld_so_cache() -> dict[str, list[str]]:
+    """SONAME -> пути из /etc/ld.so.cache (формат glibc-ld.so.cache1.1)"""
+    try:
+        with open('/etc/ld.so.cache', 'rb') as f:
+            data = f.read()
+    except OSError:
+        return {}
+    
+    # Новый формат идёт либо с начала файла, либо после записей старого
+    start = data.find(_LD_CACHE_MAGIC)
+    if start < 0:
+        return {}
+    
+    nlibs, = struct.unpack_from('=I', data, start + 20)
+    string = lambda off: data[start + off:data.index(b'\0', start + off)].decode()
+    
+    libs: dict[str, list[str]] = {}
+    for i in range(nlibs):
+        _, key, value, _, _ = struct.unpack_from('=iIIIQ', data, start + 48 + i * 24)
+        libs.setdefault(string(key), []).append(string(value))
+    return libs
+
+
+def _resolve_soname(soname: str, elf_class: int, machine: int, rpaths: list[str]) -> Optional[str]:
+    """Путь к библиотеке той же архитектуры, что и зависящий от неё бинарник"""
+    default_dirs = ['/lib64', '/usr/lib64'] if elf_class == 2 else []
+    candidates = [os.path.normpath(os.path.join(d, soname)) for d in rpaths]
+    candidates += _ld_so_cache().get(soname, [])
+    candidates += [os.path.join(d, soname) for d in default_dirs + ['/lib', '/usr/lib']]
+    
+    for path in candidates:
+        try:
+            with open(path, 'rb') as f:
+                header = f.read(20)
+        except OSError:
+            continue
+        end = '<' if header[5:6] == b'\x01' else '>'
+        if (header[:4] == b'\x7fELF' and header[4] == elf_class
+                and struct.unpack_from(end + 'H', header, 18)[0] == machine):
+            return path
+    return None
+
+
+def _elf_deps(path: str) -> list[str]:
+    """Транзитивные зависимости ELF (как ldd), без запуска ldd"""
+    elf_class, machine, interp, _, _ = _elf_info(path)
+    libs = [interp] if interp and os.path.exists(interp) else []
+    
+    # Загрузчик уже учтён по PT_INTERP, libc ссылается на него же
+    seen = {os.path.basename(interp)} if interp else set()
+    pending = [path]
+    while pending:
+        _, _, _, needed, rpaths = _elf_info(pending.pop(0))
+        for soname in needed:
+            if soname in seen:
+                continue
+            seen.add(soname)
+            lib = _resolve_soname(soname, elf_class, machine, rpaths)
+            if lib:
+                libs.append(lib)
+                pending.append(lib)
+    
+    return libs
+
+
+_MEMHOG_SRC = '''
+data = []
+for i in range(100):
+    data.append(" " * (1024 * 1024))
+    print(f"Allocated {i+1}MB")
+'''
+
+# Байткод годится только для той же версии CPython, иначе гость компилирует исходник
+_MEMHOG_CMD = (
+    "/usr/bin/python3 -c 'import sys, marshal; exec("
+    f"marshal.loads(bytes.fromhex(\"{marshal.dumps(compile(_MEMHOG_SRC, '<memhog>', 'exec')).hex()}\")) "
+    f"if sys.implementation.cache_tag == \"{sys.implementation.cache_tag}\" "
+    f"else bytes.fromhex(\"{_MEMHOG_SRC.encode().hex()}\"))'"
+)
+
+
+@dataclass(slots=True, frozen=True)
 class ContainerConfig:
     name: str
     memory_mb: int = 50
     cpu_percent: int = 25
     command: str = "/bin/sh"
+    label: Optional[str] = None  # короткая подпись команды для лога вместо самой команды
 
 
 class CGroupManager:
     
     def __init__(self, name: str):
         self.name = name
-        self.path = Path(f"/sys/fs/cgroup/{name}")
+        self.path = f"/sys/fs/cgroup/{name}"
+        self._memmax = f"{self.path}/memory.max"
+        self._cpumax = f"{self.path}/cpu.max"
+        self._procs = f"{self.path}/cgroup.procs"
+        self._peak = f"{self.path}/memory.peak"
+        self._events = f"{self.path}/memory.events"
     
     def create(self, memory_mb: int, cpu_percent: int):
-        self.path.mkdir(exist_ok=True)
+        try:
+            os.mkdir(self.path)
+        except FileExistsError:
+            pass
         
-        (self.path / "memory.max").write_text(str(memory_mb * 1024 * 1024))
-        (self.path / "cpu.max").write_text(f"{cpu_percent * 1000} 100000")
+        self._write(self._memmax, b"%d" % (memory_mb << 20))
+        self._write(self._cpumax, b"%d 100000" % (cpu_percent * 1000))
         
-        print(f"✓ CGroup: {memory_mb}MB RAM, {cpu_percent}% CPU")
+        log.info("✓ CGroup: %dMB RAM, %d%% CPU", memory_mb, cpu_percent)
+    
+    def open(self) -> int:
+        """fd каталога cgroup для clone3(CLONE_INTO_CGROUP)"""
+        return os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
     
     def add_process(self, pid: int):
-        (self.path / "cgroup.procs").write_text(str(pid))
+        self._write(self._procs, b"%d" % pid)
+    
+    def stats(self) -> dict:
+        """Пик памяти (memory.peak, Linux 5.19+) и число OOM-kill (memory.events)"""
+        stats = {'memory_peak': None, 'oom_kill': None}
+        
+        peak = self._read(self._peak)
+        if peak:
+            stats['memory_peak'] = int(peak)
+        
+        for line in (self._read(self._events) or b'').splitlines():
+            key, _, value = line.partition(b' ')
+            if key == b'oom_kill':
+                stats['oom_kill'] = int(value)
+        
+        return stats
+    
+    @staticmethod
+    def _read(path: str) -> Optional[bytes]:
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return None
+        try:
+            return os.read(fd, 4096)
+        finally:
+            os.close(fd)
+    
+    @staticmethod
+    def _write(path: str, data: bytes):
+        fd = os.open(path, os.O_WRONLY)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
     
     def cleanup(self):
         try:
-            self.path.rmdir()
+            os.rmdir(self.path)
         except OSError:
             pass
 
 
 class RootFSManager:
+    _removals: list[threading.Thread] = []
     
     def __init__(self, name: str):
         self.name = name
+        self.workdir = None
         self.rootfs = None
+        self.mounted = False
     
-    def create(self) -> Path:
-        self.rootfs = Path(tempfile.mkdtemp(prefix=f"container_{self.name}_"))
-        
-        for d in ['bin', 'lib', 'lib64', 'proc', 'tmp', 'dev', 'etc']:
-            (self.rootfs / d).mkdir(parents=True, exist_ok=True)
+    def create(self) -> str:
+        self.build_master()
+        os.makedirs(CONTAINERS_DIR, exist_ok=True)
+        self.workdir = tempfile.mkdtemp(prefix=f"container_{self.name}_", dir=CONTAINERS_DIR)
+        upper, work, self.rootfs = (f"{self.workdir}/{d}" for d in OVERLAY_DIRS)
+        _mkdirs_at(self.workdir, OVERLAY_DIRS)
         
-        if not self._setup_busybox():
-            raise RuntimeError("BusyBox недоступен. Установите: apt install busybox-static")
-        
-        self._copy_bash()
+        # Мастер — общий нижний слой, запись контейнера уходит в upper
+        try:
+            _mount("overlay", self.rootfs, "overlay", 0,
+                   f"lowerdir={MASTER_ROOTFS},upperdir={upper},workdir={work}")
+            self.mounted = True
+        except OSError:
+            self._clone_master()
         
-        print(f"✓ RootFS: {self.rootfs}")
+        log.info("✓ RootFS: %s", self.rootfs)
         return self.rootfs
     
-    def _setup_busybox(self) -> bool:
-        busybox_paths = ['/usr/bin/busybox', '/bin/busybox', '/usr/bin/busybox-static']
-        busybox_src = None
+    @classmethod
+    def build_master(cls, force: bool = False) -> str:
+        """Собрать мастер-rootfs, из которого клонируются контейнеры"""
+        stamp = cls._master_stamp()
+        if not force and cls._read_stamp() == stamp:
+            return MASTER_ROOTFS
         
-        for path in busybox_paths:
-            if os.path.exists(path):
-                busybox_src = path
-                break
+        parent = os.path.dirname(MASTER_ROOTFS)
+        os.makedirs(parent, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix="master_", dir=parent)
+        
+        try:
+            os.chmod(staging, 0o755)
+            _mkdirs_at(staging, ROOTFS_DIRS)
+            
+            if not cls._setup_busybox(staging):
+                raise RuntimeError("BusyBox недоступен. Установите: apt install busybox-static")
+            
+            cls._copy_bash(staging)
+            cls._setup_dev(staging)
+            with open(f"{staging}/{MASTER_STAMP}", 'w') as f:
+                f.write(stamp)
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+        
+        if os.path.exists(MASTER_ROOTFS):
+            shutil.rmtree(MASTER_ROOTFS)
+        os.rename(staging, MASTER_ROOTFS)
+        
+        log.info("✓ Master RootFS: %s", MASTER_ROOTFS)
+        return MASTER_ROOTFS
+    
+    @staticmethod
+    def _master_stamp() -> str:
+        """Штамп мастера: MASTER_LAYOUT и (путь, mtime, размер) бинарников и библиотек хоста"""
+        # Бинарники в мастере — жёсткие ссылки на старые inode: обновление хоста требует пересборки
+        sources = [_BUSYBOX_SRC, _BASH_SRC]
+        if _BASH_SRC:
+            # Тот же ключ (путь, mtime, размер), что у кэша _bash_deps: обновление libc тоже заметно
+            sources += RootFSManager._bash_deps(_BASH_SRC)
+        lines = [str(MASTER_LAYOUT)]
+        for src in sources:
+            if src and os.path.exists(src):
+                st = os.stat(src)
+                lines.append(f"{src} {st.st_mtime_ns} {st.st_size}")
+        return "\n".join(lines) + "\n"
+    
+    @staticmethod
+    def _read_stamp() -> Optional[str]:
+        """Штамп уже собранного мастера; None — мастера нет или он собран без штампа"""
+        try:
+            with open(f"{MASTER_ROOTFS}/{MASTER_STAMP}") as f:
+                return f.read()
+        except OSError:
+            return None
+    
+    def _clone_master(self):
+        """Клонировать мастер-rootfs (reflink/CoW, если ФС поддерживает)"""
+        # --reflink=auto делает O(1) клон на BTRFS/XFS и обычную копию на остальных ФС
+        try:
+            pid = _spawn(['cp', '--reflink=auto', '-a', f"{MASTER_ROOTFS}/.", self.rootfs])
+            _, status = os.waitpid(pid, 0)
+            if status == 0:
+                return
+        except FileNotFoundError:
+            pass
         
+        shutil.copytree(MASTER_ROOTFS, self.rootfs, symlinks=True, dirs_exist_ok=True,
+                        copy_function=_copy_node)
+    
+    @staticmethod
+    def _setup_dev(root: str):
+        """Устройства в /dev мастера: контейнеры получают их через overlay без mknod"""
+        dev_fd = os.open(f"{root}/dev", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for name, major, minor in DEV_NODES:
+                os.mknod(name, stat.S_IFCHR | 0o666, os.makedev(major, minor), dir_fd=dev_fd)
+                os.chmod(name, 0o666, dir_fd=dev_fd)
+        finally:
+            os.close(dev_fd)
+    
+    @staticmethod
+    def _setup_busybox(root: str) -> bool:
+        busybox_src = _BUSYBOX_SRC
         if not busybox_src:
             return False
         
-        busybox_dst = self.rootfs / 'bin/busybox'
-        shutil.copy2(busybox_src, busybox_dst)
-        busybox_dst.chmod(0o755)
+        busybox_dst = f"{root}/bin/busybox"
+        _fastcopy(busybox_src, busybox_dst)
+        os.chmod(busybox_dst, 0o755)
         
-        commands = ['sh', 'ls', 'cat', 'echo', 'ps', 'sleep', 'mkdir', 'rm', 'cp', 'mv']
-        for cmd in commands:
-            link = self.rootfs / 'bin' / cmd
-            if not link.exists():
-                link.symlink_to('busybox')
+        st = os.stat(busybox_src)
+        key = (busybox_src, st.st_mtime_ns, st.st_size)
+        applets = _cached(_BUSYBOX_APPLETS_CACHE, _BUSYBOX_APPLETS_CACHE_FILE, key,
+                          lambda: RootFSManager._list_applets(busybox_src))
+        
+        bin_fd = os.open(f"{root}/bin", os.O_RDONLY | os.O_DIRECTORY)
+        try:
+            for applet in applets:
+                try:
+                    os.symlink('busybox', applet, dir_fd=bin_fd)
+                except FileExistsError:
+                    pass
+        finally:
+            os.close(bin_fd)
         
         return True
     
-    def _copy_bash(self):
+    @staticmethod
+    def _list_applets(busybox_src: str) -> list[str]:
+        result = subprocess.run(
+            [busybox_src, '--list'],
+            capture_output=True,
+            text=True,
+            check=False
+        )
+        applets = [a for a in result.stdout.split() if '/' not in a and a != 'busybox']
+        return applets or ['sh', 'ls', 'cat', 'echo', 'ps', 'sleep', 'mkdir', 'rm', 'cp', 'mv']
+    
+    @staticmethod
+    def _copy_bash(root: str):
         """Копировать bash с зависимостями"""
-        bash_path = '/usr/bin/bash'
-        if not os.path.exists(bash_path):
+        bash_path = _BASH_SRC
+        if not bash_path:
             return
         
-        bash_dst = self.rootfs / 'bin/bash'
-        shutil.copy2(bash_path, bash_dst)
-        bash_dst.chmod(0o755)
-        
+        bash_dst = f"{root}/bin/bash"
+        # busybox может экспортировать апплет bash — заменяем ссылку настоящим bash
         try:
-            result = subprocess.run(
-                ['ldd', bash_path],
-                capture_output=True,
-                text=True,
-                check=False
+            os.unlink(bash_dst)
+        except FileNotFoundError:
+            pass
+        _link_or_copy(bash_path, bash_dst)
+        
+        for lib_path in RootFSManager._bash_deps(bash_path):
+            if not os.path.exists(lib_path):
+                continue
+            dst = root + lib_path
+            os.makedirs(os.path.dirname(dst), exist_ok=True)
+            if not os.path.exists(dst):
+                _link_or_copy(lib_path, dst)
+    
+    @staticmethod
+    def _bash_deps(bash_path: str) -> list[str]:
+        """Библиотеки bash, кэшируются до обновления бинарника"""
+        st = os.stat(bash_path)
+        key = (bash_path, st.st_mtime_ns, st.st_size)
+        return _cached(_BASH_DEPS_CACHE, _BASH_DEPS_CACHE_FILE, key,
+                       lambda: _elf_deps(bash_path))
+    
+    def cleanup(self):
+        # overlay отмонтируем синхронно, а удаление upper/work — в фоне
+        if self.mounted:
+            _umount2(self.rootfs, MNT_DETACH)
+            self.mounted = False
+        if self.workdir:
+            thread = threading.Thread(
+                target=shutil.rmtree,
+                args=(self.workdir,),
+                kwargs={'ignore_errors': True},
+                daemon=False
             )
-            
-            for line in result.stdout.splitlines():
-                lib_path = None
-                
-                if '=>' in line:
-                    # Формат: libc.so.6 => /lib/x86_64-linux-gnu/libc.so.6 (0x...)
-                    parts = line.split('=>')[1].strip().split()
-                    if parts and os.path.exists(parts[0]):
-                        lib_path = parts[0]
-                elif line.strip().startswith('/'):
-                    # Формат: /lib64/ld-linux-x86-64.so.2 (0x...)
-                    lib_path = line.strip().split()[0]
-                
-                if lib_path and os.path.exists(lib_path):
-                    dst = self.rootfs / lib_path.lstrip('/')
-                    dst.parent.mkdir(parents=True, exist_ok=True)
-                    if not dst.exists():
-                        shutil.copy2(lib_path, dst)
+            RootFSManager._removals = [t for t in self._removals if t.is_alive()]
+            RootFSManager._removals.append(thread)
+            thread.start()
+            self.workdir = None
+    
+    @classmethod
+    def wait_cleanup(cls):
+        """Дождаться фонового удаления каталогов прошлых контейнеров"""
+        removals, cls._removals = cls._removals, []
+        for thread in removals:
+            thread.join()
+
+
+class NamespaceHolder:
+    """Процесс-заглушка, заранее созданный в новых namespaces"""
+    
+    def __init__(self):
+        # slave-пропагация: rootfs, смонтированные позже в CONTAINERS_DIR, видны внутри
+        self.unshare_pid = _spawn(
+            [
+                'unshare',
+                '--fork',
+                '--pid',
+                '--net',
+                '--mount',
+                '--uts',
+                '--ipc',
+                '--mount-proc',
+                '--propagation', 'slave',
+                'sleep', 'infinity'
+            ],
+            setsid=True
+        )
+        self.pid = self._wait_child()
+        self.fds = {ns: os.open(f"/proc/{self.pid}/ns/{ns}", os.O_RDONLY) for ns in NAMESPACES}
+    
+    def _wait_child(self, timeout: float = 5.0) -> int:
+        """PID sleep внутри namespaces (появляется после exec)"""
+        children = f"/proc/{self.unshare_pid}/task/{self.unshare_pid}/children"
+        deadline = time.monotonic() + timeout
+        
+        while time.monotonic() < deadline:
+            pid, status = os.waitpid(self.unshare_pid, os.WNOHANG)
+            if pid:
+                raise RuntimeError(f"unshare завершился с кодом {_exit_code(status)}")
+            try:
+                with open(children) as f:
+                    pids = f.read().split()
+                if pids:
+                    with open(f"/proc/{pids[0]}/comm") as f:
+                        if f.read().strip() == 'sleep':
+                            return int(pids[0])
+            except OSError:
+                pass
+            time.sleep(0.001)
         
-        except subprocess.CalledProcessError:
+        os.kill(self.unshare_pid, signal.SIGKILL)
+        os.waitpid(self.unshare_pid, 0)
+        raise RuntimeError("Процесс-заглушка не запустился")
+    
+    def enter(self):
+        """Перейти в namespaces заглушки (PID ns — для следующего fork)"""
+        for ns in NAMESPACES:
+            _setns(self.fds[ns])
+    
+    def release(self):
+        for fd in self.fds.values():
+            os.close(fd)
+        self.fds = {}
+        try:
+            os.kill(self.pid, signal.SIGKILL)
+        except ProcessLookupError:
             pass
+        os.waitpid(self.unshare_pid, 0)
+
+
+class NamespacePool:
+    """Пул готовых namespaces; каждый выдаётся один раз и пополняется в фоне"""
     
-    def cleanup(self):
-        if self.rootfs and self.rootfs.exists():
-            shutil.rmtree(self.rootfs)
+    def __init__(self, size: int = 2):
+        self.size = size
+        self._idle = queue.SimpleQueue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._refills: list[threading.Thread] = []
+        
+        # rootfs контейнеров монтируются позже, на хосте; корень хоста может быть private.
+        # Bind-точка на CONTAINERS_DIR остаётся после close(): под ней могут быть overlay
+        # других контейнеров, а повторный вызов _make_shared её переиспользует
+        _make_shared(CONTAINERS_DIR)
+        for _ in range(size):
+            self._idle.put(NamespaceHolder())
+        
+        log.info("✓ NamespacePool: %d", size)
+    
+    def acquire(self) -> NamespaceHolder:
+        try:
+            holder = self._idle.get_nowait()
+        except queue.Empty:
+            holder = NamespaceHolder()
+        
+        return holder
+    
+    def refill(self):
+        """Пополнить пул в фоне; вызывать после fork, а не до него"""
+        thread = threading.Thread(target=self._refill)
+        with self._lock:
+            self._refills = [t for t in self._refills if t.is_alive()]
+            self._refills.append(thread)
+        thread.start()
+    
+    def wait(self):
+        """Дождаться фоновых пополнений: fork из процесса с потоками небезопасен"""
+        with self._lock:
+            refills, self._refills = self._refills, []
+        for thread in refills:
+            thread.join()
+    
+    def _refill(self):
+        try:
+            holder = NamespaceHolder()
+        except (OSError, RuntimeError):
+            return
+        
+        with self._lock:
+            if not self._closed:
+                self._idle.put(holder)
+                return
+        holder.release()
+    
+    def close(self):
+        with self._lock:
+            self._closed = True
+        
+        # Пополнения, закончившиеся после _closed, сами освобождают свои заглушки
+        self.wait()
+        while True:
+            try:
+                self._idle.get_nowait().release()
+            except queue.Empty:
+                break
 
 
 class Container:
     
-    def __init__(self, config: ContainerConfig):
+    def __init__(self, config: ContainerConfig, pool: Optional[NamespacePool] = None):
         self.config = config
+        self.pool = pool
+        self.stats = {}
         self.cgroup = CGroupManager(config.name)
         self.rootfs_mgr = RootFSManager(config.name)
     
     def run(self) -> int:
-        print(f"\n{'='*60}")
-        print(f"Контейнер: {self.config.name}")
-        print('='*60)
+        log.info("\n%s\nКонтейнер: %s\n%s", _SEP, self.config.name, _SEP)
         
         try:
             self.cgroup.create(self.config.memory_mb, self.config.cpu_percent)
             rootfs = self.rootfs_mgr.create()
             
-            print(f"🚀 Команда: {self.config.command}\n")
+            log.info("🚀 Команда: %s\n", self.config.label or self.config.command)
             
-            self.cgroup.add_process(os.getpid())
+            argv = shlex.split(self.config.command)
             
-            cmd = [
-                'unshare',
-                '--fork',
-                '--pid',
-                '--net',
-                '--mount',
-                '--uts',
-                '--ipc',
-                '--mount-proc',
-                'chroot',
-                str(rootfs),
-                self.config.command
-            ]
-            
-            result = subprocess.run(cmd)
-            return result.returncode
+            return self._launch(rootfs, argv)
         
         except KeyboardInterrupt:
-            print("\n⚠ Остановлено")
+            log.warning("\n⚠ Остановлено")
             return 130
         except Exception as e:
-            print(f"\n✗ Ошибка: {e}")
+            log.error("\n✗ Ошибка: %s", e)
             return 1
         finally:
             self._cleanup()
     
+    def _launch(self, rootfs: str, argv: list[str]) -> int:
+        """Запуск команды в новых namespaces: через C-ядро, в Python или из пула"""
+        core = None if self.pool else _load_core()
+        if core:
+            c_argv = (ctypes.c_char_p * (len(argv) + 1))(*(a.encode() for a in argv), None)
+            cgroup_fd = self.cgroup.open()
+            try:
+                code = core.pyc_run(cgroup_fd, rootfs.encode(), c_argv)
+            finally:
+                os.close(cgroup_fd)
+            if code < 0:
+                raise OSError(-code, os.strerror(-code))
+            return code
+        
+        # Python-fork только без других потоков: дочерний процесс унаследовал бы их блокировки
+        RootFSManager.wait_cleanup()
+        holder = None
+        if self.pool:
+            self.pool.wait()
+            holder = self.pool.acquire()
+        try:
+            pid = os.fork()
+            if pid == 0:
+                self._exec_in(holder, self.cgroup, rootfs, argv)
+            if self.pool:
+                self.pool.refill()
+            _, status = os.waitpid(pid, 0)
+            return _exit_code(status)
+        finally:
+            if holder:
+                holder.release()
+    
+    @staticmethod
+    def _exec_in(holder: Optional[NamespaceHolder], cgroup: CGroupManager,
+                 rootfs: str, argv: list[str]):
+        """Дочерний процесс: cgroup, namespaces, fork в PID ns, chroot и exec; не возвращается"""
+        code = 127
+        try:
+            # До setns: в чужом mount namespace /sys/fs/cgroup может не быть
+            cgroup.add_process(os.getpid())
+            if holder:
+                holder.enter()
+            else:
+                _unshare(CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWNS | CLONE_NEWUTS | CLONE_NEWIPC)
+                # Как unshare(1): монтирования контейнера не уходят на хост
+                _mount(None, "/", None, MS_REC | MS_PRIVATE)
+            
+            pid = os.fork()
+            if pid == 0:
+                if holder:
+                    # procfs заглушки уже показывает её PID namespace — подключаем его, нового не создаём
+                    _mount("/proc", f"{rootfs}/proc", None, MS_BIND | MS_REC)
+                os.chroot(rootfs)
+                os.chdir('/')
+                if not holder:
+                    _mount("proc", "/proc", "proc", MS_NOSUID | MS_NODEV | MS_NOEXEC)
+                # Как restore_signals в subprocess: игнорирование от CPython переживает execve
+                for signame in ('SIGPIPE', 'SIGXFZ', 'SIGXFSZ'):
+                    if hasattr(signal, signame):
+                        signal.signal(getattr(signal, signame), signal.SIG_DFL)
+                os.execvp(argv[0], argv)
+            
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            _, status = os.waitpid(pid, 0)
+            code = _exit_code(status)
+        except BaseException as e:
+            os.write(2, f"✗ Ошибка: {e}\n".encode())
+        finally:
+            os._exit(code)
+    
     def _cleanup(self):
         """Очистка ресурсов"""
-        print(f"\n{'='*60}")
-        print("Очистка")
-        print('='*60)
+        log.info("\n%s\nОчистка\n%s", _SEP, _SEP)
+        self.stats = self.cgroup.stats()
+        self._print_stats()
         self.cgroup.cleanup()
         self.rootfs_mgr.cleanup()
-        print("✓ Готово\n")
+        log.info("✓ Готово\n")
+    
+    def _print_stats(self):
+        peak = self.stats.get('memory_peak')
+        if peak is not None:
+            log.info("✓ Пик памяти: %.1fMB", peak / (1024 * 1024))
+        oom_kill = self.stats.get('oom_kill')
+        if oom_kill is not None:
+            log.info("✓ OOM kill: %d", oom_kill)
 
 
 def demo_interactive():
@@ -206,20 +984,11 @@ def demo_command():
 
 
 def demo_memory_limit():
-    print("\n" + "="*60)
-    print("ТЕСТ: Ограничение памяти (OOM Killer)")
-    print("="*60)
-    print("Попытка выделить 100MB при лимите 20MB\n")
+    log.info("\n%s\nТЕСТ: Ограничение памяти (OOM Killer)\n%s\n"
+             "Попытка выделить 100MB при лимите 20MB\n", _SEP, _SEP)
     
-    memory_hog = '''
-data = []
-for i in range(100):
-    data.append(" " * (1024 * 1024))
-    print(f"Allocated {i+1}MB")
-'''
-    
-    if not shutil.which('python3'):
-        print("Python3 не найден, используем busybox для теста")
+    if not _HAS_PYTHON3:
+        log.info("Python3 не найден, используем busybox для теста")
         config = ContainerConfig(
             name="mem_test",
             memory_mb=20,
@@ -231,13 +1000,38 @@ for i in range(100):
             name="mem_test",
             memory_mb=20,
             cpu_percent=50,
-            command=f'/usr/bin/python3 -c \'{memory_hog}\''
+            command=_MEMHOG_CMD,
+            label="python3 memhog (100MB)"
         )
     
-    exit_code = Container(config).run()
+    container = Container(config)
+    container.run()
     
-    if exit_code == 137:
-        print("OOM Killer сработал - лимит работает!")
+    if container.stats.get('oom_kill'):
+        log.info("OOM Killer сработал - лимит работает!")
+
+
+def demo_pool():
+    """Несколько контейнеров подряд в namespaces из пула"""
+    pool = NamespacePool(size=2)
+    try:
+        for i in range(3):
+            config = ContainerConfig(
+                name=f"pool_demo{i}",
+                memory_mb=30,
+                cpu_percent=20,
+                command=f'/bin/sh -c "echo Hello from pooled container {i}!"'
+            )
+            Container(config, pool=pool).run()
+    finally:
+        pool.close()
+
+
+def setup_master():
+    """Пересобрать мастер-rootfs и C-ядро"""
+    RootFSManager.build_master(force=True)
+    if _load_core():
+        log.info("✓ C-ядро: %s", _core_lib())
 
 
 def print_help():
@@ -249,6 +1043,8 @@ def print_help():
     shell       Интерактивный shell (BusyBox)
     run         Выполнить команду
     memory      Тест ограничения памяти
+    pool        Контейнеры из пула namespaces
+    setup       Пересобрать мастер-rootfs
     help        Показать справку
 
 Примеры:
@@ -260,14 +1056,35 @@ def print_help():
     BusyBox: apt install busybox-static
     Root права для namespaces и cgroups
 
+Переменные окружения:
+    PYC_LOG     Уровень логирования (INFO по умолчанию, WARNING — тихо)
+
 Технологии:
     Namespaces: PID, NET, MNT, UTS, IPC
     CGroups v2: Memory, CPU
     BusyBox: Минимальное окружение
+    RootFS: OverlayFS поверх мастер-образа /var/lib/pycontainer/master
     """)
 
 
+def _log_level(value: str) -> int:
+    """Уровень из PYC_LOG: имя (warning) или число (30); неизвестный — INFO"""
+    if value.isdigit():
+        return int(value)
+    level = logging.getLevelName(value.upper())
+    if isinstance(level, int):
+        return level
+    print(f"Неизвестный уровень PYC_LOG={value!r}, используется INFO", file=sys.stderr)
+    return logging.INFO
+
+
 def main():
+    logging.basicConfig(
+        level=_log_level(os.environ.get("PYC_LOG") or "INFO"),
+        format="%(message)s",
+        stream=sys.stdout
+    )
+    
     if os.geteuid() != 0:
         print("Требуются root права")
         print("Запустите: sudo python3 container.py")
@@ -277,6 +1094,8 @@ def main():
         "shell": demo_interactive,
         "run": demo_command,
         "memory": demo_memory_limit,
+        "pool": demo_pool,
+        "setup": setup_master,
         "help": print_help,
     }
     
@@ -0,0 +1,142 @@
+/*
+ * Горячий путь запуска контейнера без интерпретатора:
+ * clone3(CLONE_NEW* | CLONE_INTO_CGROUP) -> chroot -> mount proc -> execvp.
+ * На ядрах до 5.7: fork -> cgroup.procs -> unshare -> fork (PID 1) -> ...
+ *
+ * main.py собирает файл при первом запуске (cc -O2 -shared -fPIC)
+ * и вызывает pyc_run() через ctypes.
+ */
+#define _GNU_SOURCE
+#include <errno.h>
+#include <fcntl.h>
+#include <sched.h>
+#include <signal.h>
+#include <stdint.h>
+#include <stdio.h>
+#include <string.h>
+#include <sys/mount.h>
+#include <sys/syscall.h>
+#include <sys/types.h>
+#include <sys/wait.h>
+#include <unistd.h>
+
+#ifndef SYS_clone3
+#define SYS_clone3 435
+#endif
+#ifndef CLONE_INTO_CGROUP
+#define CLONE_INTO_CGROUP 0x200000000ULL
+#endif
+
+#define NS_FLAGS (CLONE_NEWPID | CLONE_NEWNET | CLONE_NEWNS | CLONE_NEWUTS | CLONE_NEWIPC)
+
+/* struct clone_args из linux/sched.h (CLONE_ARGS_SIZE_VER2) */
+struct pyc_clone_args {
+    uint64_t flags;
+    uint64_t pidfd;
+    uint64_t child_tid;
+    uint64_t parent_tid;
+    uint64_t exit_signal;
+    uint64_t stack;
+    uint64_t stack_size;
+    uint64_t tls;
+    uint64_t set_tid;
+    uint64_t set_tid_size;
+    uint64_t cgroup;
+};
+
+/* Код возврата в стиле shell: 128 + сигнал для убитых процессов */
+static int exit_code(int status)
+{
+    if (WIFSIGNALED(status))
+        return 128 + WTERMSIG(status);
+    return WEXITSTATUS(status);
+}
+
+static int wait_child(pid_t pid)
+{
+    int status;
+
+    while (waitpid(pid, &status, 0) < 0) {
+        if (errno != EINTR)
+            return -errno;
+    }
+    return exit_code(status);
+}
+
+static void fail(const char *what)
+{
+    dprintf(2, "✗ Ошибка: %s: %s\n", what, strerror(errno));
+    _exit(127);
+}
+
+/* PID 1 нового PID namespace: chroot, /proc и exec команды */
+static void exec_container(const char *rootfs, char *const argv[])
+{
+    /* Как unshare(1): монтирования контейнера не уходят на хост */
+    if (mount(NULL, "/", NULL, MS_REC | MS_PRIVATE, NULL) < 0)
+        fail("mount /");
+    if (chroot(rootfs) < 0)
+        fail("chroot");
+    if (chdir("/") < 0)
+        fail("chdir");
+    if (mount("proc", "/proc", "proc", MS_NOSUID | MS_NODEV | MS_NOEXEC, NULL) < 0)
+        fail("mount proc");
+
+    /* CPython игнорирует SIGPIPE и SIGXFSZ, а SIG_IGN переживает execve */
+    signal(SIGPIPE, SIG_DFL);
+    signal(SIGXFSZ, SIG_DFL);
+    execvp(argv[0], argv);
+    fail(argv[0]);
+}
+
+static void join_cgroup(int cgroup_fd)
+{
+    /* "0" в cgroup.procs переносит сам пишущий процесс */
+    int fd = openat(cgroup_fd, "cgroup.procs", O_WRONLY | O_CLOEXEC);
+
+    if (fd < 0 || write(fd, "0", 1) != 1)
+        fail("cgroup.procs");
+    close(fd);
+}
+
+/* Код возврата команды или -errno, если не удалось создать процесс */
+int pyc_run(int cgroup_fd, const char *rootfs, char *const argv[])
+{
+    struct pyc_clone_args args = {
+        .flags = NS_FLAGS | CLONE_INTO_CGROUP,
+        .exit_signal = SIGCHLD,
+        .cgroup = (uint64_t)cgroup_fd,
+    };
+    pid_t pid = syscall(SYS_clone3, &args, sizeof(args));
+
+    if (pid == 0)
+        exec_container(rootfs, argv);
+    if (pid > 0)
+        return wait_child(pid);
+    /* ENOSYS: нет clone3 (< 5.3), E2BIG/EINVAL: нет CLONE_INTO_CGROUP (< 5.7) */
+    if (errno != ENOSYS && errno != E2BIG && errno != EINVAL)
+        return -errno;
+
+    pid = fork();
+    if (pid < 0)
+        return -errno;
+
+    if (pid == 0) {
+        pid_t init;
+
+        join_cgroup(cgroup_fd);
+        if (unshare(NS_FLAGS) < 0)
+            fail("unshare");
+
+        init = fork();
+        if (init < 0)
+            fail("fork");
+        if (init == 0)
+            exec_container(rootfs, argv);
+
+        signal(SIGINT, SIG_IGN);
+        _exit(wait_child(init) & 0xff);
+    }
+
+    return wait_child(pid);
+}
@@ -0,0 +1,55 @@
+import os
+import re
+import shutil
+import struct
+import subprocess
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main
+
+
+def _ldd(path: str) -> set[str]:
+    """Пути библиотек из вывода ldd, без vdso"""
+    out = subprocess.run(['ldd', path], capture_output=True, text=True, check=True).stdout
+    return {os.path.realpath(m) for m in re.findall(r'(/\S+) \(0x', out)}
+
+
+class ElfDepsTest(unittest.TestCase):
+    
+    @unittest.skipUnless(shutil.which('ldd') and os.path.exists('/usr/bin/bash'), "нет ldd или bash")
+    def test_bash_matches_ldd(self):
+        deps = {os.path.realpath(p) for p in main._elf_deps('/usr/bin/bash')}
+        self.assertEqual(deps, _ldd('/usr/bin/bash'))
+    
+    def test_static_binary(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with open(f"{tmp}/static.c", 'w') as f:
+                f.write("int main(void) { return 0; }\n")
+            cc = os.environ.get('CC', 'cc')
+            built = subprocess.run([cc, '-static', '-o', f"{tmp}/static", f"{tmp}/static.c"], capture_output=True)
+            if built.returncode != 0:
+                self.skipTest("cc -static недоступен")
+            
+            self.assertEqual(main._elf_info(f"{tmp}/static")[2:], (None, [], []))
+            self.assertEqual(main._elf_deps(f"{tmp}/static"), [])
+    
+    def test_strtab_outside_load(self):
+        # ELF64 с одним PT_DYNAMIC и без PT_LOAD: DT_STRTAB не во что перевести
+        header = b'\x7fELF\x02\x01\x01' + bytes(9) + struct.pack(
+            '<HHIQQQIHHHHHH', 2, 62, 1, 0, 64, 0, 0, 64, 56, 1, 0, 0, 0)
+        phdr = struct.pack('<IIQQQQQQ', main.PT_DYNAMIC, 4, 120, 0, 0, 48, 48, 8)
+        dynamic = struct.pack('<qQqQqQ', main.DT_NEEDED, 1, main.DT_STRTAB, 0x1000, main.DT_NULL, 0)
+        
+        with tempfile.NamedTemporaryFile() as f:
+            f.write(header + phdr + dynamic)
+            f.flush()
+            with self.assertRaisesRegex(ValueError, "DT_STRTAB"):
+                main._elf_info(f.name)
+
+
+if __name__ == '__main__':
+    unittest.main()